@@ -0,0 +1,213 @@
+"""Tests for the multi-agent customer support system"""
+
+import asyncio
+import json
+
+import pytest
+
+from src.agents.customer_support_agent import (
+    BaseMemoryBank,
+    CustomerSupportMultiAgentSystem,
+    CustomTools,
+    MemoryBank,
+    RedisMemoryBank,
+    SessionState,
+    _search_knowledge_base,
+)
+
+# Each test runs on its own event loop; alru_cache drops entries from the previous one
+pytestmark = pytest.mark.filterwarnings("ignore:alru_cache detected event loop change")
+
+
+@pytest.fixture
+def redis_bank():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis needs it to run the Lua write script
+    bank = RedisMemoryBank(max_interactions=3)
+    bank.client = fakeredis.FakeRedis(decode_responses=True)
+    return bank
+
+
+@pytest.mark.asyncio
+async def test_redis_store_keeps_newest_at_head_and_trims(redis_bank):
+    for i in range(5):
+        await redis_bank.store_interaction('s1', {'i': i})
+
+    raw = redis_bank.client.lrange('task:s1:interactions', 0, -1)
+    assert len(raw) == 3
+    assert '"i":4' in raw[0]
+    assert '"i":2' in raw[-1]
+
+
+@pytest.mark.asyncio
+async def test_redis_retrieve_session_memory_is_oldest_first(redis_bank):
+    for i in range(3):
+        await redis_bank.store_interaction('s1', {'i': i})
+
+    assert [m['i'] for m in redis_bank.retrieve_session_memory('s1')] == [0, 1, 2]
+    assert [m['i'] for m in redis_bank.retrieve_session_memory('s1', limit=2)] == [1, 2]
+    assert redis_bank.retrieve_session_memory('missing') == []
+
+
+@pytest.mark.asyncio
+async def test_redis_compact_context_counts_all_interactions(redis_bank):
+    assert redis_bank.compact_context('s1') == {}
+    for i in range(5):
+        await redis_bank.store_interaction('s1', {'i': i})
+
+    compact = redis_bank.compact_context('s1')
+    assert compact['session_id'] == 's1'
+    assert compact['interaction_count'] == 5
+    assert compact['first_interaction'] <= compact['last_interaction']
+
+
+def test_redis_bank_has_no_in_process_store(redis_bank):
+    assert isinstance(redis_bank, BaseMemoryBank)
+    assert not hasattr(redis_bank, 'memory_store')
+
+
+@pytest.mark.asyncio
+async def test_failing_agent_keeps_sibling_response(caplog):
+    system = CustomerSupportMultiAgentSystem()
+
+    async def fail(query):
+        raise ValueError('routing down')
+
+    system.routing_agent.process_query = fail
+    result = await system.process_customer_request('Cannot log in')
+
+    assert isinstance(result['routing_response'], ValueError)
+    assert result['support_response'].startswith('[Technical Support] Found response:')
+    failures = [r for r in caplog.records if r.levelname == 'ERROR']
+    assert failures and failures[0].exc_info[1] is result['routing_response']
+
+
+@pytest.mark.asyncio
+async def test_retrieve_session_memory_non_positive_limit():
+    bank = MemoryBank()
+    for i in range(4):
+        await bank.store_interaction('s1', {'i': i})
+
+    assert [m['i'] for m in bank.retrieve_session_memory('s1', limit=2)] == [2, 3]
+    assert [m['i'] for m in bank.retrieve_session_memory('s1', limit=0)] == [0, 1, 2, 3]
+    assert [m['i'] for m in bank.retrieve_session_memory('s1', limit=-1)] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_search_knowledge_base_keeps_query_and_returns_fresh_results():
+    first = await CustomTools.search_knowledge_base('Reset Password ')
+    assert first['results'] == ['Result for Reset Password ']
+
+    first['results'][0] = 'tampered'
+    second = await CustomTools.search_knowledge_base('reset password')
+    assert second['results'] == ['Result for reset password']
+
+
+@pytest.mark.asyncio
+async def test_recent_summary_matches_across_memory_banks(redis_bank):
+    interactions = [{'summary': 'a'}, {'summary': 'b'}, {}, {}, {'summary': 'c'}, {'summary': 'd'}, {}]
+    memory_bank = MemoryBank()
+    for interaction in interactions:
+        await memory_bank.store_interaction('s1', dict(interaction))
+        await redis_bank.store_interaction('s1', dict(interaction))
+
+    assert memory_bank.compact_context('s1')['recent_summary'] == 'b | c | d'
+    assert redis_bank.compact_context('s1')['recent_summary'] == 'b | c | d'
+
+
+@pytest.mark.asyncio
+async def test_session_metrics_are_json_serializable():
+    system = CustomerSupportMultiAgentSystem()
+    await system.process_customer_request('Billing question')
+
+    metrics = system.get_session_metrics()
+    memory_metrics = metrics['memory_metrics']
+    assert memory_metrics['interaction_count'] == 2
+    for field in ('first_interaction', 'last_interaction'):
+        assert isinstance(memory_metrics[field], str)
+    assert isinstance(metrics['timestamp'], str)
+    assert metrics['state'] == 'active'
+    json.dumps(metrics)
+
+
+@pytest.mark.asyncio
+async def test_escalation_creates_ticket_after_agents(monkeypatch):
+    system = CustomerSupportMultiAgentSystem()
+    tickets = []
+
+    async def create_ticket(issue, priority):
+        tickets.append((issue, priority))
+        return {'ticket_id': 'TKT-test', 'status': 'created'}
+
+    monkeypatch.setattr(CustomTools, 'create_ticket', staticmethod(create_ticket))
+    result = await system.handle_complex_escalation('Outage')
+    assert result['ticket']['ticket_id'] == 'TKT-test'
+    assert tickets == [('Outage', 'high')]
+
+    async def fail(query):
+        raise ValueError('escalation down')
+
+    system.escalation_agent.process_query = fail
+    with pytest.raises(ValueError):
+        await system.handle_complex_escalation('Outage')
+    assert len(tickets) == 1
+
+
+def test_redis_write_keeps_timestamps_monotonic_and_sets_expiry(redis_bank):
+    for ts_ns in (2_000_000_000_000_000_000, 1_000_000_000_000_000_000, 3_000_000_000_000_000_000, 999):
+        redis_bank._write('s1', {'ts_ns': ts_ns, 'summary': str(ts_ns)})
+
+    meta = redis_bank.client.hgetall('task:s1')
+    assert meta['first_interaction'] == '999'
+    assert meta['last_interaction'] == '3000000000000000000'
+    assert meta['count'] == '4'
+    for key in ('task:s1', 'task:s1:interactions', 'task:s1:summaries'):
+        assert 0 < redis_bank.client.ttl(key) <= redis_bank.ttl_seconds
+
+
+@pytest.mark.asyncio
+async def test_record_stores_one_interaction_per_block():
+    bank = MemoryBank()
+
+    async with bank.record('s1', {'query': 'ok'}) as interaction:
+        interaction['response'] = 'done'
+
+    with pytest.raises(RuntimeError):
+        async with bank.record('s1', {'query': 'boom'}):
+            raise RuntimeError('tool failed')
+
+    success, failure = bank.retrieve_session_memory('s1')
+    assert success['response'] == 'done'
+    assert 'error' not in success
+    assert success['duration_ns'] >= 0
+    assert failure['error'] == "RuntimeError('tool failed')"
+    assert failure['duration_ns'] >= 0
+    assert bank.compact_context('s1')['interaction_count'] == 2
+
+
+@pytest.mark.asyncio
+async def test_pause_and_resume_session_update_reported_state():
+    system = CustomerSupportMultiAgentSystem()
+
+    await system.pause_session()
+    assert system.get_session_metrics()['state'] == 'paused'
+    assert all(agent.state == SessionState.PAUSED for agent in system._agents)
+
+    await system.resume_session()
+    assert system.get_session_metrics()['state'] == 'active'
+    assert all(agent.state == SessionState.ACTIVE for agent in system._agents)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_searches_share_one_lookup():
+    _search_knowledge_base.cache_clear()
+
+    first, second = await asyncio.gather(
+        CustomTools.search_knowledge_base('Refund status'),
+        CustomTools.search_knowledge_base('  refund STATUS '),
+    )
+
+    info = _search_knowledge_base.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+    assert first['results'] == ['Result for Refund status']
+    assert second['results'] == ['Result for   refund STATUS ']